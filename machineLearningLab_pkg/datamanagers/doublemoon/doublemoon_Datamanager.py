@@ -1,12 +1,11 @@
 import os
 THIS_FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
 
-import json
-import pandas as pd
 import numpy as np
 import torch as th
-from machineLearningLab_pkg.datamanagers.utils import DataManager, DataFold
-from machineLearningLab_pkg.datamanagers.utils.torchTensorsData import TorchTensorsDataset, TorchTensorsDataLoader
+from machineLearningLab_pkg.datamanagers.utils import DataManager, DataFold, LazyFoldGrid
+from machineLearningLab_pkg.datamanagers.utils.torchTensorsData import TorchTensorsDataset, TorchTensorsDataLoader, \
+                                                                     pin_memory_available, to_device
 from machineLearningLab_pkg.datamanagers.doublemoon import generate_resources
 
 
@@ -28,15 +27,23 @@ class DoubleMoon (DataManager):
         version (string): The version of the datamanager. Default is "v1".
         name (string): The name of the datamanager.
         readme (string): The readme of the datamanager.
-        folds (array of DataFold): The datamanager folds.
+        folds (LazyFoldGrid of DataFold): The datamanager folds, each one built the first time it is accessed.
         full_dataset (TorchTensorsDataset): The full dataset.
         full_dataloader (TorchTensorsDataLoader): The dataloader associated to full_dataset.
+        indices_split (dict of torch.Tensor): The indices of the folds samples in full_dataset, one tensor for
+            all the folds per key: "training" and "validation" have shape (n_outer, n_inner, n_samples),
+            "design" and "test" have shape (n_outer, n_samples). Read-only.
 
     Methods:
         __init__(batchSize=64, trainingDataLoaderMethod="shuffle", device="cpu", version="v1")
-        changeSettings(**kargs)
+        change_settings(**kargs)
+        changeSettings(**kargs), alias of change_settings
+        pin_memory()
     """
 
+    # Settings and attributes (name, readme, folds and device are slots of DataManager)
+    __slots__ = ("batchSize", "trainingDataLoaderMethod", "version", "full_dataset", "full_dataloader", "_indices_split")
+
     def __init__ (
             self, 
             batchSize=64,
@@ -55,15 +62,16 @@ class DoubleMoon (DataManager):
             batchSize (int, optional): The minibatch size for dataloaders. Default is 64.
             trainingDataLoaderMethod (string, optional): The method to use for training dataloaders.
                 Default is "shuffle".
-            device (string, optional): The device to use. Default is "cpu".
+            device (string, optional): The device to use. Default is "cpu". With "meta", the tensors carry only
+                shape and dtype (no data is allocated) until the first change_settings(device=...) to a real device.
             version (string, optional): The version of the datamanager. Default is "v1".
         """
 
-        # Set input arguments, name and readme
-        self.batchSize = batchSize
-        self.trainingDataLoaderMethod = trainingDataLoaderMethod
-        self.device = device
-        self.version = version
+        # Set input arguments (the settings), name and readme
+        self._register_setting("batchSize", batchSize)
+        self._register_setting("trainingDataLoaderMethod", trainingDataLoaderMethod)
+        self._register_setting("device", device)
+        self._register_setting("version", version)
         self.name = f"DoubleMoon-{version}"
         self.readme = "This binary classification task involves categorizing\n" + \
                       "points in a 2D plane that belong to two sets resembling\n" + \
@@ -71,85 +79,104 @@ class DoubleMoon (DataManager):
                       "are the y-coordinates on the cartesian plane. label[i]=0 indicates\n" + \
                       "moon 0, and label[i]=1 indicates moon 1."
 
+        # Load the data, the indices split, and create full_dataset, full_dataloader and the folds
+        self._load(device)
+
+    def _load (self, device):
+
         # Load indices_split
         try:
-            with open(f"{THIS_FOLDER_PATH}/doublemoon_indicesSplits_{version}.json") as file:
-                indices_split = json.load(file)
+            with np.load(f"{THIS_FOLDER_PATH}/doublemoon_indicesSplits_{self.version}.npz") as file:
+                indices_split = {key: file[key] for key in ("training", "validation", "design", "test")}
         except FileNotFoundError:
             generate_resources.generate_doublemoon_indicesSplits()
-            with open(f"{THIS_FOLDER_PATH}/doublemoon_indicesSplits_{version}.json") as file:
-                indices_split = json.load(file)
+            with np.load(f"{THIS_FOLDER_PATH}/doublemoon_indicesSplits_{self.version}.npz") as file:
+                indices_split = {key: file[key] for key in ("training", "validation", "design", "test")}
+        # Each array is converted (and moved to device) once as a whole: the folds are given views of it
+        indices_split = {key: _as_tensor(value, th.long, device) for key, value in indices_split.items()}
 
         # Load data
         try:
-            with open(f"{THIS_FOLDER_PATH}/doublemoon_data_{version}.csv") as file:
-                data = pd.read_csv(file)
+            with np.load(f"{THIS_FOLDER_PATH}/doublemoon_data_{self.version}.npz") as file:
+                data = {key: file[key] for key in ("x", "label")}
         except FileNotFoundError:
             generate_resources.generate_doublemoon_data()
-            with open(f"{THIS_FOLDER_PATH}/doublemoon_data_{version}.csv") as file:
-                data = pd.read_csv(file)
-        x = th.tensor(data.loc[:, ["x1", "x2"]].values, dtype=th.float, device=device)
-        y = th.tensor(data.loc[:, "label"].values, dtype=th.long, device=device)
+            with np.load(f"{THIS_FOLDER_PATH}/doublemoon_data_{self.version}.npz") as file:
+                data = {key: file[key] for key in ("x", "label")}
+        x = _as_tensor(data["x"], th.float, device)
+        y = _as_tensor(data["label"].reshape(-1), th.long, device)
+        if _is_cuda(device): th.cuda.synchronize(device)
 
         # Create full_dataset and full_dataloader
         self.full_dataset = TorchTensorsDataset(x, y)
         self.full_dataloader = TorchTensorsDataLoader(
             self.full_dataset, 
             method=self.trainingDataLoaderMethod,
-            batchSize=batchSize
+            batchSize=self.batchSize
         )
         
-        # Create folds
-        folds_shape = np.asarray(indices_split, dtype=object).shape
-        self.folds = np.empty(folds_shape, dtype=object)
-        for i_outer in range(folds_shape[0]):
-            for i_inner in range(folds_shape[1]):
-
-                fold = DataFold()
-
-                # Set parent_datamanager, name and readme
-                fold.parent_datamanager = self
-                fold.name = f"out{i_outer}in{i_inner}"
-
-                # Set datasets
-                indices = indices_split[i_outer][i_inner]
-                fold.training_dataset = self.full_dataset.subset(indices['training'])
-                fold.validation_dataset = self.full_dataset.subset(indices['validation'])
-                fold.design_dataset = self.full_dataset.subset(indices['training'] + indices['validation'])
-                fold.test_dataset = self.full_dataset.subset(indices['test'])
-
-                # Set dataloaders
-                fold.training_dataloader = TorchTensorsDataLoader(
-                    fold.training_dataset,
-                    method=self.trainingDataLoaderMethod,
-                    batchSize=batchSize
-                )
-                fold.validation_dataloader = TorchTensorsDataLoader(
-                    fold.validation_dataset,
-                    method=None,
-                    batchSize=batchSize
-                )
-                fold.design_dataloader = TorchTensorsDataLoader(
-                    fold.design_dataset,
-                    method=trainingDataLoaderMethod,
-                    batchSize=batchSize
-                )
-                fold.test_dataloader = TorchTensorsDataLoader(
-                    fold.test_dataset,
-                    method=None,
-                    batchSize=batchSize
-                )
-
-                # Add fold to self.folds
-                self.folds[i_outer, i_inner] = fold  
-
-    def changeSettings (self, **kargs):
+        # Create folds: each fold is built the first time it is accessed
+        self._indices_split = indices_split
+        self.folds = LazyFoldGrid(indices_split["training"].shape[:2], self._build_fold)
+        if getattr(self, "_pinned", False): self.pin_memory()
+
+    @property
+    def indices_split (self):
+
+        # The uniform view of the folds: fold (i_outer, i_inner) is built from row [i_outer, i_inner] (or 
+        # [i_outer]) of these tensors, without building any fold
+        return self._indices_split
+
+    def _build_fold (self, i_outer, i_inner):
+
+        fold = DataFold()
+
+        # Set parent_datamanager, name and readme
+        fold.parent_datamanager = self
+        fold.name = f"out{i_outer}in{i_inner}"
+
+        # Set datasets. They are materialized (the dataset is small): iterating them needs no gather through
+        # the indices of the fold
+        indices_split = self._indices_split
+        fold.training_dataset = self.full_dataset.subset(indices_split["training"][i_outer, i_inner], materialize=True)
+        fold.validation_dataset = self.full_dataset.subset(indices_split["validation"][i_outer, i_inner], materialize=True)
+        fold.design_dataset = self.full_dataset.subset(indices_split["design"][i_outer], materialize=True)
+        fold.test_dataset = self.full_dataset.subset(indices_split["test"][i_outer], materialize=True)
+        if getattr(self, "_pinned", False):
+            for dataset in (fold.training_dataset, fold.validation_dataset, fold.design_dataset, fold.test_dataset):
+                dataset.pin_memory()
+
+        # Set dataloaders
+        fold.training_dataloader = TorchTensorsDataLoader(
+            fold.training_dataset,
+            method=self.trainingDataLoaderMethod,
+            batchSize=self.batchSize
+        )
+        fold.validation_dataloader = TorchTensorsDataLoader(
+            fold.validation_dataset,
+            method=None,
+            batchSize=self.batchSize
+        )
+        fold.design_dataloader = TorchTensorsDataLoader(
+            fold.design_dataset,
+            method=self.trainingDataLoaderMethod,
+            batchSize=self.batchSize
+        )
+        fold.test_dataloader = TorchTensorsDataLoader(
+            fold.test_dataset,
+            method=None,
+            batchSize=self.batchSize
+        )
+
+        return fold
+
+    def change_settings (self, **kargs):
         """
         Method to change datamanager setting.
 
         Usage examples:
-            doublemoon.changeSettings(batchSize=64, device="cuda")
-            doublemoon.changeSettings(trainingDataLoaderMethod="boostrap")
+            doublemoon.change_settings(batchSize=64, device="cuda")
+            doublemoon.change_settings(trainingDataLoaderMethod="boostrap")
 
         Args:
             **kargs: keyword arguments to update the settings. Admited keys are:
@@ -161,52 +188,85 @@ class DoubleMoon (DataManager):
             self
         """
         
+        # Nothing to do if every setting already has the given value
+        if self._settings_unchanged(kargs): return self
+
+        # Only the folds built so far are updated: the others will be built with the new settings
         if "batchSize" in kargs:
 
             self.batchSize = kargs["batchSize"]
-            for i_outer in range(self.folds.shape[0]):
-                for i_inner in range(self.folds.shape[1]):
-                    fold = self.folds[i_outer, i_inner]
-                    fold.training_dataloader.set_batchSize(self.batchSize)
-                    fold.validation_dataloader.set_batchSize(self.batchSize)
-                    fold.design_dataloader.set_batchSize(self.batchSize)
-                    fold.test_dataloader.set_batchSize(self.batchSize)
+            for fold in self.folds.built_folds():
+                fold.training_dataloader.set_batchSize(self.batchSize)
+                fold.validation_dataloader.set_batchSize(self.batchSize)
+                fold.design_dataloader.set_batchSize(self.batchSize)
+                fold.test_dataloader.set_batchSize(self.batchSize)
         
         if "trainingDataLoaderMethod" in kargs:
 
             self.trainingDataLoaderMethod = kargs["trainingDataLoaderMethod"]
-            for i_outer in range(self.folds.shape[0]):
-                for i_inner in range(self.folds.shape[1]):
-                    fold = self.folds[i_outer, i_inner]
-                    fold.training_dataloader.method = self.trainingDataLoaderMethod
-                    fold.design_dataloader.method = self.trainingDataLoaderMethod
+            for fold in self.folds.built_folds():
+                fold.training_dataloader.method = self.trainingDataLoaderMethod
+                fold.design_dataloader.method = self.trainingDataLoaderMethod
         
         if "device" in kargs:
 
-            self.device = kargs["device"]
-            for i_outer in range(self.folds.shape[0]):
-                for i_inner in range(self.folds.shape[1]):
-                    fold = self.folds[i_outer, i_inner]
-                    fold.training_dataset.to(self.device)
-                    fold.validation_dataset.to(self.device)
-                    fold.design_dataset.to(self.device)
-                    fold.test_dataset.to(self.device)
+            device = kargs["device"]
+            if _is_meta(self.device) and not _is_meta(device):
+                # Meta tensors have no data to be copied: everything is loaded again, directly on device. The 
+                # folds accessed so far (shape only) are discarded
+                self.device = device
+                self._load(device)
+            else:
+                # The copies are asynchronous only towards CUDA (a non blocking copy to CPU may be read too early).
+                # The folds datasets are materialized, each one moves its own samples (see _move_all_to, which
+                # synchronizes once after all the copies)
+                non_blocking = _is_cuda(device)
+                self.full_dataset.to(device, non_blocking=non_blocking)
+                self._indices_split = {key: value.to(device, non_blocking=non_blocking) 
+                                       for key, value in self._indices_split.items()}
+                self._move_all_to(device)
 
+        self._invalidate_repr_cache()
         return self
 
-    def to (self, device):
+    def pin_memory (self):
         """
-        Move the datamanager datasets to the given device. Equivalent to changeSettings(device=device)
+        Move full_dataset, the indices split and the datasets of the folds (also the ones built afterwards, 
+        until the datamanager is moved off CPU) to pinned memory, if they are on CPU. Without CUDA nothing is 
+        done, with a warning.
 
         Usage example:
-            doublemoon.to(device)
-        
-        Args:
-            device (torch.device): The device to move the datamanager datasets to.
+            doublemoon.pin_memory()
 
         Returns:
             self
         """
 
-        self.changeSettings(device=device)
-        return self
\ No newline at end of file
+        if not pin_memory_available("pin_memory()"): return self
+        self.full_dataset.pin_memory()
+        self._indices_split = {key: value.pin_memory() if value.device.type == "cpu" else value
+                               for key, value in self._indices_split.items()}
+        return super().pin_memory()
+
+    # The previous name of change_settings, kept for backward compatibility
+    changeSettings = change_settings
+
+
+def _is_cuda (device):
+
+    return th.device(device).type == "cuda"
+
+
+def _is_meta (device):
+
+    return th.device(device).type == "meta"
+
+
+def _as_tensor (array, dtype, device):
+
+    # On the meta device only shape and dtype are set: no payload is allocated (nor copied). Otherwise the array
+    # is wrapped without copies: the only copies/casts are the ones to the target dtype and device (towards CUDA
+    # through pinned memory, asynchronously, see torchTensorsData.to_device: _load synchronizes once at the end)
+    if _is_meta(device): return th.empty(array.shape, dtype=dtype, device=device)
+    return to_device(th.from_numpy(array).to(dtype), device, non_blocking=_is_cuda(device))
+
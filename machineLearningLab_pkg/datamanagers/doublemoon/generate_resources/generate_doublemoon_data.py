@@ -1,49 +1,79 @@
 import os
 THIS_FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
 
+import math
+import types
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from numpy import pi, sqrt, cos, sin, concatenate
-import pandas as pd
+from numpy import pi, sqrt, cos, sin
 
-def generate_doublemoon_data ():
+def generate_doublemoon_data (save_csv=False, overwrite=False):
+
+    # The data are saved as binary .npz files (arrays x and label). If save_csv is True, a .csv copy 
+    # (columns id, x1, x2, label) is also saved, for human inspection (it is not committed, the .npz files are
+    # the reference data).
+    # Each version is generated only if its file is missing (or if overwrite is True), so that the files of the
+    # other versions are never rewritten. The recipe of each version is frozen: versions 1 and 2 use the
+    # sampling of the time they were generated (_sample_v1, float64), so that they are reproduced exactly
 
     # -------- Version 1: 2024-02-18 (num_samples = 1000, noise = 0) --------
 
-    name = "doublemoon_data_v1.csv"
-    num_samples = 1000
-    noise = 0
-    rng = np.random.default_rng(42)
+    name = "doublemoon_data_v1.npz"
+    filePath = f"{THIS_FOLDER_PATH}/../{name}"
+    if overwrite or not os.path.exists(filePath):
 
-    print(f"Generating {name} ...", end="")
+        num_samples = 1000
+        noise = 0
+        rng = np.random.default_rng(42)
 
-    doublemoon_datasource = DoubleMoon_DataSource(noise=noise)
-    x, label = doublemoon_datasource.sample(num_samples, rng=rng)
-    df = pd.DataFrame(x, columns=["x1", "x2"])
-    df["label"] = label
-    df.index.name = "id"
-    filePath = f"{THIS_FOLDER_PATH}/../{name}"
-    df.to_csv(filePath, index=True)
+        print(f"Generating {name} ...", end="")
+
+        doublemoon_datasource = DoubleMoon_DataSource(noise=noise)
+        x, label = _sample_v1(doublemoon_datasource, num_samples, rng=rng)
+        np.savez(filePath, x=x, label=label)
+        if save_csv: _save_csv(x, label, filePath.replace(".npz", ".csv"))
 
-    print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
+        print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
 
     # -------- Version 2: 2024-03-09 (num_samples = 1000, noise = 0.16) --------
 
-    name = "doublemoon_data_v2.csv"
-    num_samples = 1000
-    noise = 0.16
-    rng = np.random.default_rng(42)
+    name = "doublemoon_data_v2.npz"
+    filePath = f"{THIS_FOLDER_PATH}/../{name}"
+    if overwrite or not os.path.exists(filePath):
 
-    print(f"Generating {name} ...", end="")
+        num_samples = 1000
+        noise = 0.16
+        rng = np.random.default_rng(42)
 
-    doublemoon_datasource = DoubleMoon_DataSource(noise=noise)
-    x, label = doublemoon_datasource.sample(num_samples, rng=rng)
-    df = pd.DataFrame(x, columns=["x1", "x2"])
-    df["label"] = label
-    df.index.name = "id"
+        print(f"Generating {name} ...", end="")
+
+        doublemoon_datasource = DoubleMoon_DataSource(noise=noise)
+        x, label = _sample_v1(doublemoon_datasource, num_samples, rng=rng)
+        np.savez(filePath, x=x, label=label)
+        if save_csv: _save_csv(x, label, filePath.replace(".npz", ".csv"))
+
+        print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
+
+    # -------- Version 3: 2026-10-14 (num_samples = 1000, noise = 0.16, batched float32 sampling) --------
+
+    name = "doublemoon_data_v3.npz"
     filePath = f"{THIS_FOLDER_PATH}/../{name}"
-    df.to_csv(f"{THIS_FOLDER_PATH}/../{name}", index=True)
+    if overwrite or not os.path.exists(filePath):
+
+        num_samples = 1000
+        noise = 0.16
+        rng = np.random.default_rng(42)
+
+        print(f"Generating {name} ...", end="")
 
-    print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
+        doublemoon_datasource = DoubleMoon_DataSource(noise=noise)
+        x, label = doublemoon_datasource.sample(num_samples, rng=rng)
+        np.savez(filePath, x=x, label=label)
+        if save_csv: _save_csv(x, label, filePath.replace(".npz", ".csv"))
+
+        print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
 
 
 # ************************************************************************************************
@@ -51,6 +81,71 @@ def generate_doublemoon_data ():
 # ************************************************************************************************
 
 
+def _save_csv (x, label, filePath):
+
+    # pandas is imported here, so that importing this module (as the datamanager does) does not import it
+    import pandas as pd
+    df = pd.DataFrame(x, columns=["x1", "x2"])
+    df["label"] = label
+    df.index.name = "id"
+    df.to_csv(filePath, index=True)
+
+
+def _sample_v1 (datasource, num_samples, class0_size=0.5, rng=None):
+
+    # The sampling used to generate versions 1 and 2 (do not change it, or they are no more reproduced): in 
+    # float64, class 0 then class 1, each drawing angle, radius, x_1 noise and x_2 noise in this order (the 
+    # noise is drawn even if datasource.noise is 0)
+    if rng is None: rng = np.random.default_rng(None)
+    inner_radius_squared = (1 - datasource.width/2)**2
+    outer_radius_squared = (1 + datasource.width/2)**2
+    num_samples_class0 = int(class0_size*num_samples)
+    x, label = [], []
+    for class_label, center, flip, n in ((0, datasource.center_class0, 1, num_samples_class0), 
+                                         (1, datasource.center_class1, -1, num_samples - num_samples_class0)):
+        angle = pi*rng.random(n)
+        r = sqrt(inner_radius_squared + rng.random(n)*(outer_radius_squared - inner_radius_squared))
+        x_1 = center[0] + r*cos(angle) + datasource.noise*rng.normal(size=n)
+        x_2 = center[1] + flip*r*sin(angle) + datasource.noise*rng.normal(size=n)
+        x.append(np.stack((x_1, x_2), axis=1))
+        label.append(np.full((n, 1), class_label, dtype=int))
+    return np.concatenate(x), np.concatenate(label)
+
+
+# Below this number of samples the numba kernel is not worth its dispatch (and first-call compilation) cost
+NUMBA_MIN_NUM_SAMPLES = 100_000
+# Below this number of samples numexpr is not worth its dispatch cost
+NUMEXPR_MIN_NUM_SAMPLES = 10_000
+
+
+def sample_concurrently (datasources, num_samples, rngs, class0_size=0.5, max_workers=None):
+    """
+    Call datasource.sample for many (datasource, rng) pairs at once on a thread pool, as instance for a sweep 
+    over noise values and seeds. The jitted kernel and most NumPy operations release the GIL, so the calls 
+    run in parallel on multiple cores.
+
+    Usage example:
+        samples = sample_concurrently([DoubleMoon_DataSource(noise=noise) for noise in noises], num_samples,
+                                      [np.random.default_rng(seed) for seed in seeds])
+
+    Args:
+        datasources (list of DoubleMoon_DataSource): The datasources to sample from.
+        num_samples (int): Number of data points of each sample.
+        rngs (list of np.random._generator.Generator): The random number generators, one for each datasource.
+        class0_size (float, optional): The percentage of samples to be allocated to class 0. Defaults is 0.5.
+        max_workers (int, optional): The number of threads. Default is None, i.e., os.cpu_count().
+
+    Returns:
+        samples (list of tuples): samples[i] = (x, label) is the output of datasources[i].sample.
+    """
+
+    if max_workers is None: max_workers = os.cpu_count()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(datasource.sample, num_samples, class0_size, rng, parallel=False)
+                   for datasource, rng in zip(datasources, rngs)]
+        return [future.result() for future in futures]
+
+
 class DoubleMoon_DataSource:
     """
     Class for generating double moon data.
@@ -99,12 +194,20 @@ class DoubleMoon_DataSource:
         self.width = width
         self.noise = noise
 
-        self._inner_radius_squared = (1 - self.width/2)**2
-        self._outer_radius_squared = (1 + self.width/2)**2
+        # float32 copies of the constants used by sample(), so that the computation stays in float32
+        self._center_class0 = np.asarray(self.center_class0, dtype=np.float32)
+        self._center_class1 = np.asarray(self.center_class1, dtype=np.float32)
+        self._inner_radius_squared = np.float32((1 - self.width/2)**2)
+        self._outer_radius_squared = np.float32((1 + self.width/2)**2)
+        # The squared radius of a sample is _inner_radius_squared + u*_range_radius_squared, with u uniform in [0,1)
+        self._range_radius_squared = self._outer_radius_squared - self._inner_radius_squared
 
-    def sample (self, num_samples, class0_size=0.5, rng=None):
+    def sample (self, num_samples, class0_size=0.5, rng=None, parallel=True):
         """
-        Sample data points from classes 0 and 1 and concatenate them into a single dataset.
+        Sample data points from classes 0 and 1 into a single dataset.
+        All the random numbers are drawn with a single call per distribution. If numba is installed and 
+        num_samples >= NUMBA_MIN_NUM_SAMPLES, the samples are computed by a jitted kernel, which releases the GIL.
+        Otherwise, if numexpr is installed and num_samples >= NUMEXPR_MIN_NUM_SAMPLES, by fused numexpr expressions.
 
         Usage examples:
             x, label = doublemoon_datasource.sample(num_samples, rng=rng)
@@ -114,9 +217,11 @@ class DoubleMoon_DataSource:
             class0_size (float, optional): The percentage of samples to be allocated to class 0. Defaults is 0.5.
             rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a new generator
                 with random seed is created.
+            parallel (bool, optional): If True, the jitted kernel runs on multiple threads. Set it to False when 
+                sample is called from several threads at once (see sample_concurrently). Default is True.
 
         Returns:
-            x (array of float): The data points. x.shape = (num_samples, 2), where x[:,0] are the x-coordinates 
+            x (array of float32): The data points. x.shape = (num_samples, 2), where x[:,0] are the x-coordinates 
                 and x[:,1] are the y-coordinates on the cartesian plane.
             label (array of int): The labels. label.shape = (num_samples, 1). label[i]=0 indicates class 0, and 
                 label[i]=1 indicates class 1.
@@ -124,31 +229,128 @@ class DoubleMoon_DataSource:
         
         if rng is None: rng = np.random.default_rng(None)
         num_samples_class0 = int(class0_size*num_samples)
-        num_samples_class1 = num_samples - num_samples_class0
-        x_class0, label_class0 = self._class0_sample(num_samples_class0, rng)
-        x_class1, label_class1 = self._class1_sample(num_samples_class1, rng)
-        x, label = concatenate((x_class0, x_class1)), concatenate((label_class0, label_class1))
+        x = np.empty((num_samples, 2), dtype=np.float32)
+        label = np.empty((num_samples, 1), dtype=np.int8)
+        # The random numbers are the same whichever implementation computes the samples, so that a given rng
+        # state gives the same dataset whether the optional accelerators are installed or not
+        u = rng.random((num_samples, 2), dtype=np.float32)
+        g = rng.standard_normal((num_samples, 2), dtype=np.float32) if self.noise != 0. else None
+        kernels = _numba_kernels() if num_samples >= NUMBA_MIN_NUM_SAMPLES else None
+        if kernels is not None:
+            kernel = kernels[0] if parallel else kernels[1]
+            kernel(u, g if g is not None else np.zeros((0, 2), dtype=np.float32),
+                   self._center_class0[0], self._center_class0[1], self._center_class1[0], self._center_class1[1],
+                   self._inner_radius_squared, self._range_radius_squared, self.noise, 
+                   num_samples_class0, x, label)
+            return x, label
+        ne = _numexpr() if num_samples >= NUMEXPR_MIN_NUM_SAMPLES else None
+        if ne is not None:
+            self._moons_sample_numexpr(ne, x, label, num_samples_class0, u, g)
+            return x, label
+        self._moons_sample(x, label, num_samples_class0, u, g)
         return x, label
         
-    def _class0_sample (self, num_samples, rng=None):
+    def _moons_sample (self, out_x, out_label, num_samples_class0, u, g):
 
-        if rng is None: rng = np.random.default_rng(None)
-        angle = pi*rng.random(num_samples)
-        r = sqrt(self._inner_radius_squared + rng.random(num_samples)*(self._outer_radius_squared - self._inner_radius_squared))
-        x_1 = (self.center_class0[0] + r*cos(angle) + self.noise*rng.normal(size=num_samples)).reshape(-1, 1)
-        x_2 = (self.center_class0[1] + r*sin(angle) + self.noise*rng.normal(size=num_samples)).reshape(-1, 1)
-        x = concatenate((x_1, x_2), axis=1)
-        label = np.zeros((num_samples, 1), dtype=int)
+        # Both classes are computed in a single vectorized pass and written in place into out_x and out_label:
+        # rows [:num_samples_class0] are class 0, the others class 1, which is class 0 flipped along x_2.
+        # u[:,0] and u[:,1] are the uniform draws for angle and radius, g the gaussian draws for noise
+        # (None if there is no noise)
+        angle = pi*u[:, 0]
+        r = sqrt(self._inner_radius_squared + u[:, 1]*self._range_radius_squared)
+        np.multiply(r, cos(angle), out=out_x[:, 0])
+        np.multiply(r, sin(angle), out=out_x[:, 1])
+        np.negative(out_x[num_samples_class0:, 1], out=out_x[num_samples_class0:, 1])
+        out_x[:num_samples_class0] += self._center_class0
+        out_x[num_samples_class0:] += self._center_class1
+        if g is not None: out_x += self.noise*g
+        out_label[:num_samples_class0] = 0
+        out_label[num_samples_class0:] = 1
 
-        return x, label
-    
-    def _class1_sample (self, num_samples, rng=None):
+    def _moons_sample_numexpr (self, ne, out_x, out_label, num_samples_class0, u, g):
 
-        if rng is None: rng = np.random.default_rng(None)
-        angle = pi*rng.random(num_samples)
-        r = sqrt(self._inner_radius_squared + rng.random(num_samples)*(self._outer_radius_squared - self._inner_radius_squared))
-        x_1 = (self.center_class1[0] + r*cos(angle) + self.noise*rng.normal(size=num_samples)).reshape(-1, 1)
-        x_2 = (self.center_class1[1] - r*sin(angle) + self.noise*rng.normal(size=num_samples)).reshape(-1, 1)
-        x = concatenate((x_1, x_2), axis=1)
-        label = np.ones((num_samples, 1), dtype=int)
-        return x, label
\ No newline at end of file
+        # Same as _moons_sample, but each output column of each class is computed by a single fused, 
+        # multithreaded numexpr expression (ne is the numexpr module), without intermediate arrays
+        noise_term = " + noise*g" if g is not None else ""
+        classes = ((slice(None, num_samples_class0), self._center_class0, 1), 
+                   (slice(num_samples_class0, None), self._center_class1, -1))
+        for rows, center, flip in classes:
+            variables = {
+                "pi": np.float32(pi), "r2_in": self._inner_radius_squared, "r2_range": self._range_radius_squared,
+                "angle_u": u[rows, 0], "radius_u": u[rows, 1], "noise": np.float32(self.noise),
+                "c": center[0], "g": g[rows, 0] if g is not None else None
+            }
+            ne.evaluate("c + sqrt(r2_in + radius_u*r2_range)*cos(pi*angle_u)" + noise_term, 
+                        local_dict=variables, out=out_x[rows, 0], casting="same_kind")
+            variables.update({"c": center[1], "flip": np.float32(flip), "g": g[rows, 1] if g is not None else None})
+            ne.evaluate("c + flip*sqrt(r2_in + radius_u*r2_range)*sin(pi*angle_u)" + noise_term, 
+                        local_dict=variables, out=out_x[rows, 1], casting="same_kind")
+        out_label[:num_samples_class0] = 0
+        out_label[num_samples_class0:] = 1
+
+
+@functools.lru_cache(maxsize=None)
+def _numexpr ():
+
+    # numexpr is optional, it is only used to speed up the generation of medium-size datasets. It is imported the
+    # first time one is sampled (not when importing this module). Return the module, or None if not installed
+    try:
+        import numexpr
+    except ImportError:
+        return None
+    return numexpr
+
+
+# numba is optional, it is only used to speed up the generation of large datasets. It is imported (and the
+# kernels are compiled) by _numba_kernels, the first time a large dataset is sampled: importing this module (as
+# the datamanager does, to load the prebuilt resources) does not import it
+_numba_kernels_cache = []
+_numba_kernels_lock = threading.Lock()
+
+
+def _numba_kernels ():
+
+    # The jitted kernels (parallel, serial), or None if numba is not installed
+    with _numba_kernels_lock:
+        if not _numba_kernels_cache: _numba_kernels_cache.append(_compile_numba_kernels())
+        return _numba_kernels_cache[0]
+
+
+def _compile_numba_kernels ():
+
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    def _moons_kernel (u, g, cx0, cy0, cx1, cy1, r2_in, r2_range, noise, N0, out_x, out_label):
+
+        # Single pass over the samples: rows i < N0 belong to class 0, the others to class 1.
+        # u[:,0] and u[:,1] are the uniform draws for angle and radius, g the gaussian draws for noise, read 
+        # only if noise != 0 (the branch is loop invariant, so it is hoisted out of the loop).
+        for i in prange(u.shape[0]):
+            angle = math.pi*u[i, 0]
+            r = math.sqrt(r2_in + u[i, 1]*r2_range)
+            if i < N0:
+                out_x[i, 0] = cx0 + r*math.cos(angle)
+                out_x[i, 1] = cy0 + r*math.sin(angle)
+                out_label[i, 0] = 0
+            else:
+                out_x[i, 0] = cx1 + r*math.cos(angle)
+                out_x[i, 1] = cy1 - r*math.sin(angle)
+                out_label[i, 0] = 1
+            if noise != 0.:
+                out_x[i, 0] += noise*g[i, 0]
+                out_x[i, 1] += noise*g[i, 1]
+
+    # The same kernel, running on the calling thread only, for concurrent calls from several threads (numba's 
+    # default workqueue threading layer does not support concurrent parallel launches). prange acts as range here.
+    # It is compiled from a renamed copy of the function: numba's on-disk cache is named after the function, and 
+    # its index does not tell parallel and serial compilations apart, so the serial kernel would load the 
+    # parallel one from the cache
+    _moons_kernel_serial = types.FunctionType(_moons_kernel.__code__, _moons_kernel.__globals__, "_moons_kernel_serial",
+                                              _moons_kernel.__defaults__, _moons_kernel.__closure__)
+    _moons_kernel_serial.__qualname__ = _moons_kernel.__qualname__ + "_serial"
+    moons_kernel = njit(parallel=True, nogil=True, fastmath=True, cache=True)(_moons_kernel)
+    moons_kernel_serial = njit(nogil=True, fastmath=True, cache=True)(_moons_kernel_serial)
+    return moons_kernel, moons_kernel_serial
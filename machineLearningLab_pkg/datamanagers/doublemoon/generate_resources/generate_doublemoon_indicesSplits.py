@@ -1,61 +1,102 @@
 import os
 THIS_FOLDER_PATH = os.path.dirname(os.path.abspath(__file__))
 
-from machineLearningLab_pkg.datamanagers.utils.splittingMethods import kfold
-import json
+from machineLearningLab_pkg.datamanagers.utils.splittingMethods import kfold_batch
 import numpy as np
 
 
-def generate_doublemoon_indicesSplits ():
+def generate_doublemoon_indicesSplits (overwrite=False):
+
+    # Each version is generated only if its file is missing (or if overwrite is True), so that the files of the
+    # other versions are never rewritten. The recipe of each version is frozen: versions 1 and 2 use the
+    # k-fold splitting of the time they were generated (_kfold_v1), so that they are reproduced exactly.
+    # training[i_outer, i_inner], validation[i_outer, i_inner], design[i_outer] and test[i_outer] are
+    # the indices of each fold
 
     # -------- Version 1: 2024-02-18 (Nested k-fold CV: 5 outer folds, 5 inner folds) --------
 
-    name = "doublemoon_indicesSplits_v1.json"
-    num_indices = 1000 # = len(pd.read_csv("doublemoon_data_v1.csv"))
-    rng = np.random.default_rng(42)
-    num_outerFolds = 5
-    num_innerFolds = 5
+    name = "doublemoon_indicesSplits_v1.npz"
+    filePath = f"{THIS_FOLDER_PATH}/../{name}"
+    if overwrite or not os.path.exists(filePath):
 
-    print(f"Generating {name} ...", end="")
+        num_indices = 1000 # = len(np.load("doublemoon_data_v1.npz")["x"])
+        rng = np.random.default_rng(42)
+        num_outerFolds = 5
+        num_innerFolds = 5
 
-    indices_split = [[{} for i_inner in range(num_innerFolds)] for i_outer in range(num_outerFolds)]
-    design_indices, test_indices = kfold(num_indices, num_outerFolds, rng=rng)
-    for i_outer in range(num_outerFolds):
-        training_indices, validation_indices = kfold(design_indices[i_outer], num_innerFolds, rng=rng)
-        for i_inner in range(num_innerFolds):
-            indices_split[i_outer][i_inner] = {}
-            indices_split[i_outer][i_inner]['training'] = training_indices[i_inner].tolist()
-            indices_split[i_outer][i_inner]['validation'] = validation_indices[i_inner].tolist()
-            indices_split[i_outer][i_inner]['test'] = test_indices[i_outer].tolist()
+        print(f"Generating {name} ...", end="")
 
-    filePath = f"{THIS_FOLDER_PATH}/../{name}"
-    with open(filePath, 'w') as file:
-        json.dump(indices_split, file)
+        training, validation, design, test = _nested_kfold_v1(num_indices, num_outerFolds, num_innerFolds, rng)
+        np.savez_compressed(filePath, training=training, validation=validation, design=design, test=test)
 
-    print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
+        print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
 
     # -------- Version 2: 2024-03-09 (A copy of Version 1) --------
 
-    name = "doublemoon_indicesSplits_v2.json"
-    num_indices = 1000 # = len(pd.read_csv("doublemoon_data_v2.csv"))
-    rng = np.random.default_rng(42)
-    num_outerFolds = 5
-    num_innerFolds = 5
+    name = "doublemoon_indicesSplits_v2.npz"
+    filePath = f"{THIS_FOLDER_PATH}/../{name}"
+    if overwrite or not os.path.exists(filePath):
 
-    print(f"Generating {name} ...", end="")
+        num_indices = 1000 # = len(np.load("doublemoon_data_v2.npz")["x"])
+        rng = np.random.default_rng(42)
+        num_outerFolds = 5
+        num_innerFolds = 5
 
-    indices_split = [[{} for i_inner in range(num_innerFolds)] for i_outer in range(num_outerFolds)]
-    design_indices, test_indices = kfold(num_indices, num_outerFolds, rng=rng)
-    for i_outer in range(num_outerFolds):
-        training_indices, validation_indices = kfold(design_indices[i_outer], num_innerFolds, rng=rng)
-        for i_inner in range(num_innerFolds):
-            indices_split[i_outer][i_inner] = {}
-            indices_split[i_outer][i_inner]['training'] = training_indices[i_inner].tolist()
-            indices_split[i_outer][i_inner]['validation'] = validation_indices[i_inner].tolist()
-            indices_split[i_outer][i_inner]['test'] = test_indices[i_outer].tolist()
+        print(f"Generating {name} ...", end="")
 
+        training, validation, design, test = _nested_kfold_v1(num_indices, num_outerFolds, num_innerFolds, rng)
+        np.savez_compressed(filePath, training=training, validation=validation, design=design, test=test)
+
+        print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
+
+    # -------- Version 3: 2026-10-14 (Nested k-fold CV: 5 outer folds, 5 inner folds, batched splitting) --------
+
+    name = "doublemoon_indicesSplits_v3.npz"
     filePath = f"{THIS_FOLDER_PATH}/../{name}"
-    with open(filePath, 'w') as file:
-        json.dump(indices_split, file)
+    if overwrite or not os.path.exists(filePath):
+
+        num_indices = 1000 # = len(np.load("doublemoon_data_v3.npz")["x"])
+        rng = np.random.default_rng(42)
+        num_outerFolds = 5
+        num_innerFolds = 5
+
+        print(f"Generating {name} ...", end="")
 
-    print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
\ No newline at end of file
+        design, test = kfold_batch(num_indices, num_outerFolds, rng=rng)
+        # The inner folds of all the outer folds are generated at once (one row of design per outer fold,
+        # each row shuffled independently by a single draw)
+        training, validation = kfold_batch(design, num_innerFolds, rng=rng)
+        np.savez_compressed(filePath, training=training, validation=validation, design=design, test=test)
+
+        print(f" done! Save at path:\n  {os.path.abspath(filePath)}")
+
+
+# ************************************************************************************************
+# Utils
+# ************************************************************************************************
+
+
+def _kfold_v1 (indices, n_folds, rng):
+
+    # The k-fold splitting used to generate versions 1 and 2 (do not change it, or they are no more reproduced):
+    # the test folds are contiguous chunks of a permutation of indices, the training indices are each the sorted
+    # complement of a test fold
+    permuted_indices = rng.permutation(indices)
+    test_indices = np.array_split(permuted_indices, n_folds)
+    training_indices = [np.setdiff1d(indices, test_indices[i]) for i in range(n_folds)]
+    return training_indices, test_indices
+
+
+def _nested_kfold_v1 (num_indices, num_outerFolds, num_innerFolds, rng):
+
+    # Nested k-fold CV of versions 1 and 2: the outer split, then the inner split of each outer fold in turn,
+    # all drawn from rng. The folds are stacked into int32 arrays
+    indices = np.arange(num_indices)
+    design_indices, test_indices = _kfold_v1(indices, num_outerFolds, rng)
+    training, validation = [], []
+    for i_outer in range(num_outerFolds):
+        training_indices, validation_indices = _kfold_v1(design_indices[i_outer], num_innerFolds, rng)
+        training.append(training_indices)
+        validation.append(validation_indices)
+    return (np.array(training, dtype=np.int32), np.array(validation, dtype=np.int32),
+            np.array(design_indices, dtype=np.int32), np.array(test_indices, dtype=np.int32))
@@ -19,7 +19,7 @@ class DataFold:
         validation_dataloader (DataLoader): The validation dataloader.
         design_dataloader (DataLoader): The design (training + validation) dataloader.
         test_dataloader (DataLoader): The test dataloader.
-        **Additional custom attributes
+        **Additional custom attributes, which must be declared in the __slots__ of a subclass.
 
     Methods:
         __init__(parent_datamanager, name,
@@ -28,6 +28,11 @@ class DataFold:
                 **kargs)
     """
 
+    # Instances have no __dict__: additional custom attributes must be declared in the __slots__ of a subclass
+    __slots__ = ("parent_datamanager", "name",
+                 "training_dataset", "validation_dataset", "design_dataset", "test_dataset",
+                 "training_dataloader", "validation_dataloader", "design_dataloader", "test_dataloader")
+
     def __init__ (self, 
                   parent_datamanager=None, 
                   name=None,
@@ -61,9 +66,13 @@ class DataFold:
             validation_dataloader (DataLoader): The validation dataloader.
             design_dataloader (DataLoader): The design (training + validation) dataloader.
             test_dataloader (DataLoader): The test dataloader.
-            **kargs: Additional keyword arguments. Each key-value pair is added as an attribute.
-                As instance: If kargs = {"cat": [1,2], "dog": "hello"}, the returned object will have
+            **kargs: Additional keyword arguments. Each key-value pair is added as an attribute, and each key
+                must be declared in the __slots__ of a subclass. As instance: If a subclass declares
+                __slots__ = ("cat", "dog") and kargs = {"cat": [1,2], "dog": "hello"}, the returned object will have
                 attributes datafold.cat = [1,2] and datafold.dog = "hello".
+
+        Raises:
+            TypeError: If a key of kargs is not a declared attribute.
     	"""
 
         self.parent_datamanager = parent_datamanager
@@ -76,15 +85,20 @@ class DataFold:
         self.validation_dataloader = validation_dataloader
         self.design_dataloader = design_dataloader
         self.test_dataloader = test_dataloader
-        self.__dict__.update(kargs)
+        for key, value in kargs.items():
+            try:
+                setattr(self, key, value)
+            except AttributeError:
+                raise TypeError(f"{self.__class__.__name__} got an unexpected keyword argument '{key}'") from None
 
     def __repr__ (self):
 
         description = f"DataFold(\n"
         description += f"  name: {self.name},\n"
-        for key, value in self.__dict__.items():
-            if key not in ["parent_datamanager", "name"]:
-                description += f"  {key}: {str(value)},\n"
+        for cls in reversed(type(self).__mro__):
+            for key in cls.__dict__.get("__slots__", ()):
+                if key not in ["parent_datamanager", "name"]:
+                    description += f"  {key}: {str(getattr(self, key, None))},\n"
         description += ")"
         return description
     
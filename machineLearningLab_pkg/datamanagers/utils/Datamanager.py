@@ -1,91 +1,303 @@
+import os
+import mmap
+from abc import ABC, abstractmethod
 import numpy as np
+import torch as th
+from .torchTensorsData import pin_memory_available
+from .LazyFoldGrid import LazyFoldGrid
 
 
-class DataManager:
+# Default of getattr, for attributes which may be unset
+_MISSING = object()
+
+# Header of the readme section of DataManager.__repr__, and maximum number of readme characters printed there
+_README_BANNER = "\n\n" + 30*"*" + " README " + 30*"*" + "\n\n"
+_REPR_README_MAX = 512
+
+
+class DataManager (ABC):
     """
-    DataManager class for managing data folds.
+    DataManager class for managing data folds. It is abstract: a datamanager is an instance of a subclass, 
+    which implements __init__ and change_settings (see below, and the doublemoon datamanager for an example).
 
     Usage example:
-        datamanager = DataManager(**kargs)
+        datamanager = MyDataManager(**kargs) # MyDataManager is a subclass of DataManager
         datamanager.change_settings(**kargs)
         datamanager.folds[idx]
+        datamanager[idx] # same as datamanager.folds[idx]
+        len(datamanager) # same as len(datamanager.folds)
 
     Attributes:
-        folds (list of DataFold): List to store data folds.
+        folds (list of DataFold, nested lists of DataFold, or LazyFoldGrid): The data folds.
         name (str): The name of the datamanager.
-        readme (str): The readme of the datamanager.
-        **Additional custom attributes, corresponding to each setting.
+        readme (str): The readme of the datamanager. A large readme can be left on disk, setting 
+            self._readme_path: it is then read (through a memory map) only when accessed.
+        device: The device of the datamanager datasets, for datamanagers which have this setting.
+        **Additional custom attributes, corresponding to each setting, which must be declared in the __slots__ 
+            of a subclass.
 
     Methods:
         __init__(**kargs)
         change_settings(**kargs)
+        to(device)
+        pin_memory()
+        __len__()
+        __getitem__(idx)
+
+    Subclassing:
+        - Instances have no __dict__: each attribute of a subclass (settings included) must be declared in its 
+          __slots__ (name, readme, folds and device are already declared here).
+        - __init__ sets self.name, self.readme (or self._readme_path) and self.folds, and sets each setting with 
+          self._register_setting(name, value): only the registered settings are printed by repr(datamanager).
+        - change_settings(**kargs) may return self at once if self._settings_unchanged(kargs). Otherwise it
+          updates the settings (and the folds) and calls self._invalidate_repr_cache() before returning self.
+          For a device setting, self._move_all_to(device) moves the datasets of the folds built so far.
+        - to(device) needs no override: it calls change_settings(device=device) if the device changes.
     """
 
+    # Instances have no __dict__: the settings (and any other attribute) of a subclass must be declared in its
+    # __slots__. _setting_keys are the names of the settings printed by __repr__, _repr_cache its cached output,
+    # _pinned is True after pin_memory (until the datasets are moved off CPU)
+    __slots__ = ("name", "_readme", "_readme_path", "folds", "device", "_setting_keys", "_repr_cache", "_pinned")
+
+    # First line of __repr__, set once per class (see __init_subclass__)
+    _repr_header = "DataManager(\n"
+
+    def __init_subclass__ (cls, **kargs):
+
+        super().__init_subclass__(**kargs)
+        cls._repr_header = cls.__name__ + "(\n"
+
+    @abstractmethod
     def __init__(self, **kargs):
         """
-    	Abstract constructor for the class.
+    	Abstract constructor for the class. DataManager (or a subclass not implementing __init__ and 
+        change_settings) cannot be instantiated: it raises TypeError.
 
         Args:
             **kargs: Additional keyword arguments, for setting up datamanager settings.
-
-        Raises:
-            NotImplementedError: This method must be implemented by subclasses.
         """
 
         # In subclasses, here:
         #   - the construction of self.folds must be implemented
         #   - self.name must be defined
-        #   - self.readme must be defined
-
-        self.name = ""
-        self.readme = ""
-        self.folds = []
-        raise NotImplementedError
+        #   - self.readme must be defined (or self._readme_path, the path of a UTF-8 text file, for a large readme
+        #     which is read only when needed)
+        #   - each setting must be set with self._register_setting(name, value), so that __repr__ prints it
+        # The change_settings of subclasses must call self._invalidate_repr_cache(), see __repr__, and may return
+        # immediately if self._settings_unchanged(kargs).
+        # If the datamanager has a device setting, it should be stored as self.device, and the tensors should
+        # be created directly on that device (not created elsewhere and then moved with .to(device)). On the "meta"
+        # device the tensors should be created with shape and dtype only, and the data loaded at the first move 
+        # to a real device
 
+    @abstractmethod
     def change_settings (self, **kargs):
         """
         Abstract method to change some datamanager setting.
 
         Args:
             **kargs: Additional keyword arguments, to change some datamanager setting.
-
-        Raises:
-            NotImplementedError: This method must be implemented by subclasses.
         """
-        
-        raise NotImplementedError
     
     def to (self, device):
         """
-        Move the datamanager datasets to the given device. Equivalent to changeSettings(device=device)
+        Move the datamanager datasets to the given device. Equivalent to change_settings(device=device), 
+        but nothing is done if the datamanager is already on that device (self.device, e.g. "cuda" is the same
+        device as "cuda:0" if that is the current CUDA device). After the move, self.device is a torch.device.
 
         Usage example:
             self.to(device)
         
         Args:
-            device (torch.device): The device to move the datamanager datasets to.
+            device (torch.device): The device to move the datamanager datasets to. From the "meta" device, the 
+                data are loaded directly on device.
 
         Returns:
             self
         """
 
-        self.changeSettings(device=device)
+        device = _normalize_device(device)
+        if getattr(self, "device", None) is not None and _normalize_device(self.device) == device: return self
+        self.change_settings(device=device)
         return self
 
+    def pin_memory (self):
+        """
+        Move the CPU datasets of the folds to pinned memory, so that the following moves to CUDA (e.g. of each
+        fold, or with self.to(device)) are asynchronous. The folds built afterwards should be pinned too, by 
+        the subclasses which build folds lazily (self._pinned is True). Without CUDA nothing is done, with a 
+        warning.
+
+        Usage example:
+            datamanager.pin_memory()
+
+        Returns:
+            self
+        """
+
+        if not pin_memory_available("pin_memory()"): return self
+        self._pinned = True
+        for fold in _iter_folds(self.folds):
+            for key in _FOLD_DATASETS:
+                dataset = getattr(fold, key, None)
+                if dataset is not None: dataset.pin_memory()
+        return self
+
+    def __len__ (self):
+        """
+        Return the number of folds along the first axis, len(self.folds).
+        """
+
+        return len(self.folds)
+
+    def __getitem__ (self, idx):
+        """
+        Return the fold at the given index, self.folds[idx].
+        """
+
+        return self.folds[idx]
 
     def __repr__ (self):
+
+        # The description is cached, and rebuilt only if some printed attribute has been rebound or after
+        # _invalidate_repr_cache (which change_settings implementations must call, since settings may change 
+        # in place). The printed settings are the registered ones, see _register_setting. The cache holds the
+        # printed objects themselves (not their ids, which may be reused once an object is freed) and compares
+        # them by identity
+        keys = tuple(getattr(self, "_setting_keys", ()))
+        items = [(key, getattr(self, key)) for key in keys]
+        watched = (self.name, getattr(self, "_readme", None), getattr(self, "_readme_path", None), self.folds) + \
+                  tuple(value for key, value in items)
+        cache = getattr(self, "_repr_cache", None)
+        if cache is not None and cache[0] == keys and all(new is old for new, old in zip(watched, cache[1])): 
+            return cache[2]
     
-        description = self.__class__.__name__ + "(\n"
-        description += f"  name: {self.name},\n"
-        description += f"  folds shape: {np.asarray(self.folds, dtype=object).shape},\n"
-        for key, value in self.__dict__.items():
-            if key not in ["name", "folds", "readme", "data"]:
-                description += f"  {key}: {str(value)},\n"
-        description += ")"
-        if self.readme:
-            description += "\n\n" + 30*"*" + " README " + 30*"*" + "\n\n" + self.readme + "\n"
+        # The parts are joined once, instead of growing the description string line by line
+        parts = [self._repr_header,
+                 f"  name: {self.name},\n",
+                 f"  folds shape: {_nested_shape(self.folds)},\n"]
+        parts.extend(f"  {key}: {str(value)},\n" for key, value in items)
+        parts.append(")")
+        # Long readmes are truncated, to keep the description short (e.g. in logs). A readme on disk is read only
+        # up to the printed part
+        readme, truncated = self._readme_head(_REPR_README_MAX)
+        if readme:
+            parts.append(_README_BANNER + readme + ("..." if truncated else "") + "\n")
+        description = "".join(parts)
+        self._repr_cache = (keys, watched, description)
         return description
 
-    def __str__(self):
+    def __str__ (self):
+
+        return repr(self)
+
+    @property
+    def readme (self):
+
+        # Read from self._readme_path (if set) at each access, so that the instance does not hold the text
+        path = getattr(self, "_readme_path", None)
+        if path is not None: return _read_text(path)[0]
+        return getattr(self, "_readme", "")
+
+    @readme.setter
+    def readme (self, value):
+
+        self._readme = value
+        self._readme_path = None
+
+    def _readme_head (self, max_length):
+
+        # The first max_length characters of the readme, and whether it is longer
+        path = getattr(self, "_readme_path", None)
+        if path is not None: return _read_text(path, max_length)
+        readme = getattr(self, "_readme", "")
+        return readme[:max_length], len(readme) > max_length
+
+    def _register_setting (self, name, value):
+
+        # Set the setting attribute and record its name (in registration order) for __repr__
+        setattr(self, name, value)
+        if not hasattr(self, "_setting_keys"): self._setting_keys = []
+        if name not in self._setting_keys: self._setting_keys.append(name)
+
+    def _settings_unchanged (self, kargs):
+
+        # True if each setting in kargs already has the given value (devices are compared normalized), so that 
+        # change_settings implementations can return immediately
+        for key, value in kargs.items():
+            current = getattr(self, key, _MISSING)
+            if key == "device" and current is not _MISSING: 
+                current, value = _normalize_device(current), _normalize_device(value)
+            if current is _MISSING or current != value: return False
+        return True
+
+    def _invalidate_repr_cache (self):
+
+        self._repr_cache = None
+
+    def _move_all_to (self, device):
+
+        # Move the datasets of the folds built so far to device (and set self.device), for the change_settings of
+        # subclasses. Towards CUDA, every copy is issued asynchronously (from pinned memory, see
+        # TorchTensorsDataset.to) and the device is synchronized once at the end, instead of once per tensor
+        self.device = device
+        if th.device(device).type != "cpu": self._pinned = False
+        non_blocking = th.device(device).type == "cuda"
+        for fold in _iter_folds(self.folds):
+            for key in _FOLD_DATASETS:
+                dataset = getattr(fold, key, None)
+                if dataset is not None: dataset.to(device, non_blocking=non_blocking)
+        if non_blocking: th.cuda.synchronize(device)
+
+
+def _normalize_device (device):
+
+    # torch.device with an explicit index for CUDA ("cuda" is the current CUDA device), so that the same device
+    # always compares equal
+    device = th.device(device)
+    if device.type == "cuda" and device.index is None: device = th.device("cuda", th.cuda.current_device())
+    return device
+
+
+def _read_text (path, max_length=None):
+
+    # Decode the first max_length characters (all of them if None) of a UTF-8 text file through a memory map, 
+    # without reading the rest of the file. Return the text and whether the file is longer. A UTF-8 character takes
+    # at most 4 bytes, so the first 4*max_length bytes are enough: a character they cut is decoded past 
+    # max_length, and dropped. Invalid bytes are decoded as U+FFFD (not silently dropped)
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0: return "", False
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            data = buffer[:] if max_length is None else buffer[:4*max_length]
+            text = data.decode("utf-8", errors="replace")
+            if max_length is None or len(text) <= max_length: return text, len(buffer) > len(data)
+            return text[:max_length], True
+
+
+# The DataFold attributes moved by DataManager._move_all_to and pinned by DataManager.pin_memory
+_FOLD_DATASETS = ("training_dataset", "validation_dataset", "design_dataset", "test_dataset")
+
+
+def _iter_folds (folds):
+
+    # Iterate over the folds built so far: only the cached ones for a LazyFoldGrid, every element of a 
+    # (nested) list otherwise
+    if isinstance(folds, LazyFoldGrid):
+        yield from folds.built_folds()
+    elif isinstance(folds, (list, tuple, np.ndarray)):
+        for item in folds: yield from _iter_folds(item)
+    elif folds is not None:
+        yield folds
+
+
+def _nested_shape (folds):
 
-        return repr(self)
\ No newline at end of file
+    # Shape of the folds container. Nested lists are probed only through their first element at each 
+    # level, instead of converting the whole container to an object array.
+    if isinstance(folds, (np.ndarray, LazyFoldGrid)): return folds.shape
+    shape = []
+    while isinstance(folds, (list, tuple)):
+        shape.append(len(folds))
+        folds = folds[0] if folds else None
+    return tuple(shape)
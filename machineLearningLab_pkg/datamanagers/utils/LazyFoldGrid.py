@@ -0,0 +1,113 @@
+import operator
+
+
+class LazyFoldGrid:
+    """
+    Grid of folds (e.g. outer folds x inner folds), where each fold is built the first time it is accessed
+    and then cached.
+
+    Usage example:
+        folds = LazyFoldGrid(shape, build_fold)
+        fold = folds[i_outer, i_inner]
+        outer_fold = folds[i_outer] # list of the folds folds[i_outer, i_inner] for each i_inner
+        first_inner_folds = folds[:, 0] # list of the folds folds[i_outer, 0] for each i_outer
+        folds.shape
+
+    Attributes:
+        shape (tuple of int): The shape of the grid.
+        build_fold (callable): build_fold(*idx) returns the fold at index idx (a tuple of len(shape) ints).
+
+    Methods:
+        __init__(shape, build_fold)
+        __len__()
+        __getitem__(idx)
+        __iter__()
+        built_folds()
+    """
+
+    __slots__ = ("shape", "build_fold", "_built")
+
+    def __init__ (self, shape, build_fold):
+        """
+        Constructor for the class.
+
+        Usage example:
+            folds = LazyFoldGrid(shape, build_fold)
+
+        Args:
+            shape (tuple of int): The shape of the grid.
+            build_fold (callable): build_fold(*idx) returns the fold at index idx (a tuple of len(shape) ints).
+        """
+
+        self.shape = tuple(int(n) for n in shape)
+        self.build_fold = build_fold
+        self._built = {}
+
+    def __len__ (self):
+        """
+        Return the size of the first axis of the grid.
+        """
+
+        return self.shape[0]
+
+    def __getitem__ (self, idx):
+        """
+        Return the fold at the given index, building it if it is accessed for the first time. Each entry of
+        the index is an int or a slice, as for a numpy array: an int selects along its axis, a slice (and each
+        missing trailing entry, as ":") keeps the axis, as a list. As instance, folds[i_outer] and 
+        folds[i_outer, :] are the lists of the folds folds[i_outer, i_inner] for each i_inner, folds[:, 0] the
+        list of the first inner folds, folds[0:2] a list of two such lists.
+        """
+
+        if not isinstance(idx, tuple): idx = (idx,)
+        if len(idx) > len(self.shape):
+            raise IndexError(f"too many indices: the grid is {len(self.shape)}-dimensional")
+        idx = idx + (slice(None),)*(len(self.shape) - len(idx))
+        return self._get(idx, ())
+
+    def _get (self, idx, fold_idx):
+
+        # The folds (or nested lists of folds) selected by idx[len(fold_idx):], in the sub-grid at fold_idx 
+        # (the normalized indices of the previous axes)
+        if len(fold_idx) == len(self.shape):
+            if fold_idx not in self._built:
+                self._built[fold_idx] = self.build_fold(*fold_idx)
+            return self._built[fold_idx]
+        axis = len(fold_idx)
+        i, n = idx[axis], self.shape[axis]
+        if isinstance(i, slice):
+            return [self._get(idx, fold_idx + (j,)) for j in range(*i.indices(n))]
+        i = operator.index(i)
+        if not -n <= i < n:
+            raise IndexError(f"index {i} is out of bounds for axis {axis} with size {n}")
+        return self._get(idx, fold_idx + (i % n,))
+
+    def __iter__ (self):
+        """
+        Iterate over the first axis of the grid.
+        """
+
+        for i in range(self.shape[0]):
+            yield self[i]
+
+    def built_folds (self):
+        """
+        Return the folds built so far (the others will be built when accessed).
+
+        Usage example:
+            for fold in folds.built_folds():
+                <...>
+
+        Returns:
+            folds (list of DataFold): The folds built so far.
+        """
+
+        return list(self._built.values())
+
+    def __repr__ (self):
+
+        return f"LazyFoldGrid(shape={self.shape}, built={len(self._built)})"
+
+    def __str__ (self):
+
+        return repr(self)
@@ -1,5 +1,6 @@
 from .Datafold import DataFold
 from .Datamanager import DataManager
+from .LazyFoldGrid import LazyFoldGrid
 
 # Insert utilities modules here below
 from . import splittingMethods
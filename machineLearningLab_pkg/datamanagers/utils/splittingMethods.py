@@ -1,6 +1,25 @@
+import os
 import numpy as np
 
 
+# Used when no rng is given, to avoid seeding a new generator at each call
+_GLOBAL_RNG = np.random.default_rng(None)
+
+def _reseed_global_rng ():
+
+    # A forked child process inherits the state of _GLOBAL_RNG: it is reseeded, so that parallel workers 
+    # (e.g. of a multiprocessing fork Pool) draw different splits
+    global _GLOBAL_RNG
+    _GLOBAL_RNG = np.random.default_rng(None)
+
+if hasattr(os, "register_at_fork"): # POSIX only (other platforms spawn processes, re-importing this module)
+    os.register_at_fork(after_in_child=_reseed_global_rng)
+
+# holdout draws the training indices with rng.choice, instead of shuffling all the indices, when the training
+# set is smaller than this fraction of the indices
+_HOLDOUT_CHOICE_MAX_FRACTION = 0.01
+
+
 def plain (indices, trainingSize):
     """
     Split indices into training and test indices, without shuffling.
@@ -9,7 +28,7 @@ def plain (indices, trainingSize):
         training_indices, test_indices = plain(indices, trainingSize)
     
     Args:
-        indices (int or array of int): If int, generates indices up to that number using np.arange(indices). 
+        indices (int or array of int): If int, generates int32 indices up to that number using np.arange(indices). 
             If array-like, the indices themselves.
         trainingSize (int or float): The size of the training set. If int, it is the number of indices.
             If float, it is the fraction of indices, between 0 and 1.
@@ -19,7 +38,7 @@ def plain (indices, trainingSize):
         test_indices (array of int). The test indices.
     """
 
-    if isinstance(indices, int): indices = np.arange(indices)
+    if isinstance(indices, (int, np.integer)): indices = np.arange(indices, dtype=np.int32)
     if isinstance(trainingSize, float):
         trainingSize = int(len(indices) * trainingSize)
     training_indices = indices[:trainingSize]
@@ -36,23 +55,33 @@ def holdout (indices, trainingSize, rng=None):
         training_indices, test_indices = holdout(indices, trainingSize, rng)
     
     Args:
-        indices (int or array of int): If int, generates indices up to that number using np.arange(indices). 
+        indices (int or array of int): If int, generates int32 indices up to that number using np.arange(indices). 
             If array-like, the indices themselves.
         trainingSize (int or float): The size of the training set. If int, it is the number of indices.
             If float, it is the fraction of indices, between 0 and 1.
-        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a new generator
-            with random seed is created.
+        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a module-level
+            generator with random seed is used. It is reseeded in forked child processes, so that parallel 
+            workers draw different splits.
     
     Returns:
         training_indices (array of int). The training indices.
-        test_indices (array of int). The test indices.
+        test_indices (array of int). The test indices. If the training set is very small (less than 1% of the 
+            indices), the test indices are not shuffled, they keep their original order.
     """
 
-    if rng is None: rng = np.random.default_rng(None)
-    if isinstance(indices, int): indices = np.arange(indices)
-    permuted_indices = rng.permutation(indices)
+    if rng is None: rng = _GLOBAL_RNG
+    num_indices = indices if isinstance(indices, (int, np.integer)) else len(indices)
     if isinstance(trainingSize, float):
-        trainingSize = int(len(indices) * trainingSize)
+        trainingSize = int(num_indices * trainingSize)
+    if trainingSize < _HOLDOUT_CHOICE_MAX_FRACTION*num_indices:
+        # Draw only the few training positions, the test indices are the complement
+        indices = np.arange(indices, dtype=np.int32) if isinstance(indices, (int, np.integer)) else np.asarray(indices)
+        training_positions = rng.choice(num_indices, size=trainingSize, replace=False)
+        is_test = np.ones(num_indices, dtype=bool)
+        is_test[training_positions] = False
+        return indices[training_positions], indices[is_test]
+    permuted_indices = np.arange(indices, dtype=np.int32) if isinstance(indices, (int, np.integer)) else np.array(indices)
+    rng.shuffle(permuted_indices)
     training_indices = permuted_indices[:trainingSize]
     test_indices = permuted_indices[trainingSize:]
     return training_indices, test_indices
@@ -67,29 +96,31 @@ def repeated_holdout (indices, trainingSize, n_repetitions, rng=None):
         training_indices, test_indices = repeated_holdout(indices, trainingSize, n_repetitions, rng)
     
     Args:
-        indices (int or array of int): If int, generates indices up to that number using np.arange(indices). 
+        indices (int or array of int): If int, generates int32 indices up to that number using np.arange(indices). 
             If array-like, the indices themselves.
         trainingSize (int or float): The size of the training set. If int, it is the number of indices.
             If float, it is the fraction of indices, between 0 and 1.
         n_repetitions (int): The number of repetitions.
-        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a new generator
-            with random seed is created.
+        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a module-level
+            generator with random seed is used. It is reseeded in forked child processes, so that parallel 
+            workers draw different splits.
     
     Returns:
-        training_indices (list of arrays of int). The training indices.
-        test_indices (list of arrays of int). The test indices.
+        training_indices (array of int). The training indices, training_indices[i] are those of the i-th 
+            repetition. training_indices.shape = (n_repetitions, trainingSize).
+        test_indices (array of int). The test indices, test_indices[i] are those of the i-th repetition.
+            test_indices.shape = (n_repetitions, len(indices) - trainingSize).
     """
 
-    if rng is None: rng = np.random.default_rng(None)
-    if isinstance(indices, int): indices = np.arange(indices)
+    if rng is None: rng = _GLOBAL_RNG
+    indices = np.arange(indices, dtype=np.int32) if isinstance(indices, (int, np.integer)) else np.asarray(indices)
     if isinstance(trainingSize, float):
         trainingSize = int(len(indices) * trainingSize)
-    training_indices = []
-    test_indices = []
-    for i in range(n_repetitions):
-        permuted_indices = rng.permutation(indices)
-        training_indices.append(permuted_indices[:trainingSize])
-        test_indices.append(permuted_indices[trainingSize:])
+    # One row per repetition, each row shuffled independently by a single call
+    permuted_indices = _permute_rows(rng, np.tile(indices, (n_repetitions, 1)))
+    # Each of the two is copied into its own contiguous buffer
+    training_indices = np.ascontiguousarray(permuted_indices[:, :trainingSize])
+    test_indices = np.ascontiguousarray(permuted_indices[:, trainingSize:])
     return training_indices, test_indices
 
 
@@ -102,20 +133,89 @@ def kfold (indices, n_folds, rng=None):
         training_indices, test_indices = kfold(indices, n_folds, rng)
 
     Args:
-        indices (int or array of int): If int, generates indices up to that number using np.arange(indices). 
+        indices (int or array of int): If int, generates int32 indices up to that number using np.arange(indices). 
             If array-like, the indices themselves.
         n_folds (int): The number of folds.
-        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a new generator
-            with random seed is created.
+        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a module-level
+            generator with random seed is used. It is reseeded in forked child processes, so that parallel 
+            workers draw different splits.
     
     Returns:
-        training_indices (list of arrays of int). The training indices for each fold.
+        training_indices (list of arrays of int). The training indices for each fold, in permuted (not sorted) order.
         test_indices (list of arrays of int). The test indices for each fold.
     """
 
-    if rng is None: rng = np.random.default_rng(None)
-    if isinstance(indices, int): indices = np.arange(indices)
-    permuted_indices = rng.permutation(indices)
-    test_indices = np.array_split(permuted_indices, n_folds)
-    training_indices = [np.setdiff1d(indices, test_indices[i]) for i in range(n_folds)]
-    return training_indices, test_indices
\ No newline at end of file
+    if rng is None: rng = _GLOBAL_RNG
+    permuted_indices = np.arange(indices, dtype=np.int32) if isinstance(indices, (int, np.integer)) else np.array(indices)
+    rng.shuffle(permuted_indices)
+    # Each test fold is a contiguous block of permuted_indices (sized as np.array_split does): the training 
+    # indices are what lies around it, taken as permuted_indices rolled so that the test fold is at the end
+    # (the block after the test fold, then the one before it), i.e., a single copy of two contiguous views
+    fold_sizes = np.full(n_folds, len(permuted_indices)//n_folds)
+    fold_sizes[:len(permuted_indices) % n_folds] += 1
+    offsets = np.concatenate(([0], np.cumsum(fold_sizes)))
+    test_indices = [permuted_indices[offsets[i]:offsets[i+1]] for i in range(n_folds)]
+    training_indices = [np.concatenate((permuted_indices[offsets[i+1]:], permuted_indices[:offsets[i]])) 
+                        for i in range(n_folds)]
+    return training_indices, test_indices
+
+
+def kfold_batch (indices, n_folds, rng=None):
+    """
+    Split indices into k folds of equal size, as kfold does, but return the folds stacked into arrays.
+    With the same rng state, the folds are the same as the ones of kfold, training indices 
+    order included. The number of indices must be a multiple of n_folds. If indices is a 2D array, each row is
+    split independently (e.g. the design indices of all the outer folds of a nested k-fold CV).
+
+    Usage examples:
+        training_indices, test_indices = kfold_batch(indices, n_folds)
+        training_indices, test_indices = kfold_batch(indices, n_folds, rng)
+
+    Args:
+        indices (int, array of int or 2D array of int): If int, generates int32 indices up to that number 
+            using np.arange(indices). If array-like, the indices themselves. If 2D array, a batch of indices
+            arrays, one per row.
+        n_folds (int): The number of folds.
+        rng (np.random._generator.Generator): Random number generator. Default is None, i.e., a module-level
+            generator with random seed is used. It is reseeded in forked child processes, so that parallel 
+            workers draw different splits.
+    
+    Returns:
+        training_indices (array of int). The training indices, training_indices[i] are those of the i-th fold,
+            in permuted (not sorted) order as in kfold. 
+            training_indices.shape = (n_folds, len(indices) - len(indices)//n_folds). For a 2D input, 
+            training_indices[j, i] are those of the i-th fold of the j-th row.
+        test_indices (array of int). The test indices, test_indices[i] are those of the i-th fold.
+            test_indices.shape = (n_folds, len(indices)//n_folds). For a 2D input, test_indices[j, i] are
+            those of the i-th fold of the j-th row.
+    """
+
+    if rng is None: rng = _GLOBAL_RNG
+    permuted_indices = np.arange(indices, dtype=np.int32) if isinstance(indices, (int, np.integer)) else np.array(indices)
+    if permuted_indices.shape[-1] % n_folds != 0:
+        raise Exception("len(indices) % n_folds == 0 must be True")
+    if permuted_indices.ndim == 1:
+        rng.shuffle(permuted_indices)
+    else: # All the rows are permuted independently in a single call
+        permuted_indices = _permute_rows(rng, permuted_indices)
+    test_indices = permuted_indices.reshape(permuted_indices.shape[:-1] + (n_folds, -1))
+    # The training indices of the i-th fold are all the folds of test_indices but the i-th one, in the rolled 
+    # order of kfold: the folds after the i-th one, then the ones before it. A single gather for all the folds
+    other_folds = (np.arange(n_folds)[:, None] + np.arange(1, n_folds)) % n_folds
+    training_indices = test_indices[..., other_folds, :].reshape(test_indices.shape[:-2] + (n_folds, -1))
+    return training_indices, test_indices
+
+
+# ************************************************************************************************
+# Utils
+# ************************************************************************************************
+
+
+def _permute_rows (rng, a):
+
+    # Permute each row of the 2D array a independently (in place when possible), and return the permuted array
+    if hasattr(rng, "permuted"):
+        return rng.permuted(a, axis=-1, out=a)
+    # Generator.permuted is missing in NumPy < 1.20: sort each row by random keys instead
+    order = np.argsort(rng.random(a.shape), axis=-1)
+    return np.take_along_axis(a, order, axis=-1)
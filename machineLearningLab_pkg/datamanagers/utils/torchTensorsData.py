@@ -1,3 +1,4 @@
+import warnings
 import torch as th
 import numpy as np
 
@@ -25,8 +26,9 @@ class TorchTensorsDataset:
         __init__(x, y)
         __len__()
         __getitem__(idx)
-        to(device)
-        subset(idx)
+        to(device, non_blocking=False)
+        pin_memory()
+        subset(idx, materialize=False)
     """
 
     def __init__ (self, x, y):
@@ -67,51 +69,100 @@ class TorchTensorsDataset:
         index of the corresponding element in the indices array. 
         """
     
-        if self.indices is not None: 
-            return self.x[self.indices[idx]], self.y[self.indices[idx]]
+        if self.indices is not None:
+            # self.indices are already composed against the root x and y (see subset): a single gather each.
+            # On CUDA, index_select is used for 1-dim selections (it is faster than advanced indexing, above 
+            # all with the repeated indices of bootstrap)
+            indices = self.indices[idx]
+            if indices.dim() == 1 and indices.device.type == "cuda":
+                return self.x.index_select(0, indices), self.y.index_select(0, indices)
+            return self.x[indices], self.y[indices]
         else:
             return self.x[idx], self.y[idx]
     
-    def subset (self, idx):
+    def subset (self, idx, materialize=False):
         """
         Return a subset of the dataset, corresponding to the given indices.
 
-        Usage example:
+        Usage examples:
             subdataset = dataset.subset(idx)
+            subdataset = dataset.subset(idx, materialize=True)
 
         Args:
-            idx (range or list of int): The indices of the samples to be included in the subset.
+            idx (range, list of int, array of int or torch.Tensor): The indices of the samples to be included
+                in the subset.
+            materialize (bool, optional): If False, the subset shares x and y with the dataset and holds the
+                indices of its samples. If True, the samples are gathered once into new contiguous x and y
+                tensors (and subset.indices is None), so that indexing the subset needs no gather.
+                Default is False.
 
         Returns:
             subset (TorchTensorsDataset): The subset.
         """
     
+        # idx is converted as a whole, never element by element (no copy if it is already a long tensor on
+        # self.x.device)
+        if isinstance(idx, range):
+            idx = th.arange(idx.start, idx.stop, idx.step, device=self.x.device, dtype=th.long)
+        elif isinstance(idx, np.ndarray):
+            idx = th.from_numpy(np.ascontiguousarray(idx, dtype=np.int64))
+        elif not isinstance(idx, th.Tensor):
+            idx = th.from_numpy(np.fromiter(idx, dtype=np.int64))
+        idx = idx.to(device=self.x.device, dtype=th.long)
+        if materialize: return TorchTensorsDataset(*self._select_xy(idx))
+        if self.indices is not None: idx = self.indices[idx]
         sub = TorchTensorsDataset(self.x, self.y)
-        if self.indices is not None:
-            sub.indices = self.indices[idx]
-        else: 
-            sub.indices = th.tensor(list(idx), device=self.x.device, dtype=th.long)
+        sub.indices = idx
         sub.length = sub.indices.shape[0]
         return sub
     
-    def to (self, device):
+    def _select_xy (self, idx=None):
+
+        # Gather the samples at the given positions (a long tensor on self.x.device, or None for all the samples)
+        # into new contiguous x and y tensors, without building a subset object
+        if self.indices is not None: idx = self.indices if idx is None else self.indices[idx]
+        if idx is None: return self.x, self.y
+        return self.x.index_select(0, idx), self.y.index_select(0, idx)
+
+    def to (self, device, non_blocking=False):
         """
         Move the dataset to the given device.
 
-        Usage example:
+        Usage examples:
             dataset.to(device)
+            dataset.to(device, non_blocking=True)
 
         Args:
             device (torch.device): The device to move the dataset to.
+            non_blocking (bool, optional): If True, the copies are asynchronous when possible, see 
+                torch.Tensor.to: copies from CPU to CUDA go through pinned memory (see to_device). 
+                Default is False.
 
         Returns:
             None
         """
 
         self.device = device
-        self.x = self.x.to(device)
-        self.y = self.y.to(device)
-        if self.indices is not None: self.indices = self.indices.to(device)
+        self.x = to_device(self.x, device, non_blocking)
+        self.y = to_device(self.y, device, non_blocking)
+        if self.indices is not None: self.indices = to_device(self.indices, device, non_blocking)
+ 
+    def pin_memory (self):
+        """
+        Move the dataset tensors to pinned memory, if they are on CPU (and not pinned yet), so that the following
+        copies to CUDA are asynchronous. Without CUDA nothing is done, with a warning.
+
+        Usage example:
+            dataset.pin_memory()
+
+        Returns:
+            None
+        """
+
+        if self.x.device.type != "cpu" or not pin_memory_available("pin_memory()"): return
+        if not self.x.is_pinned(): self.x = self.x.pin_memory()
+        if not self.y.is_pinned(): self.y = self.y.pin_memory()
+        if self.indices is not None and not self.indices.is_pinned(): self.indices = self.indices.pin_memory()
  
     def __repr__ (self):
           
@@ -136,16 +187,20 @@ class TorchTensorsDataLoader:
         method (str): The method to use. Must be in [None, 'shuffle', 'bootstrap'].
         batchSize (int): The minibatch size.
         dropLast (bool): If True, drop the last batch if it is not full.
+        pinMemory (bool): If True, the batches of a CPU dataset are in pinned memory.
+        generator (torch.Generator): The random number generator for shuffle and bootstrap. None means the
+            default torch generator.
         n_batches (int): The number of batches.
         effectiveLength (int): n_batches * batchSize.
 
     Methods:
-        __init__(torchTensorsDataset, method=None, batchSize=None, dropLast=True)
+        __init__(torchTensorsDataset, method=None, batchSize=None, dropLast=True, pinMemory=False, generator=None)
         __len__()
-        __getitem__(idx)
+        __iter__()
     """
 
-    def __init__ (self, torchTensorsDataset, method=None, batchSize=None, dropLast=False):
+    def __init__ (self, torchTensorsDataset, method=None, batchSize=None, dropLast=False, pinMemory=False, 
+                  generator=None):
         """
         Constructor for the class.
 
@@ -158,9 +213,19 @@ class TorchTensorsDataLoader:
                 default is None.
             batchSize (int, optional): The minibatch size. default is None, i.e., the dataset length.
             dropLast (bool, optional): If True, drop the last batch if it is not full. default is False.
+            pinMemory (bool, optional): If True and the dataset is on CPU, the samples of each epoch are 
+                gathered in pinned memory, so that the batches can be moved to CUDA asynchronously 
+                (x_batch.to(device, non_blocking=True)). Without CUDA it is ignored, with a warning (pinned 
+                memory is allocated through the CUDA driver). default is False.
+            generator (torch.Generator, optional): The random number generator for shuffle and bootstrap, e.g.
+                th.Generator().manual_seed(seed) for a reproducible stream owned by this dataloader. The indices
+                are drawn on generator.device and then moved to the dataset device. default is None, i.e., 
+                the default torch generator, on the dataset device.
         """
         
         self.dataset = torchTensorsDataset
+        self.pinMemory = pinMemory and pin_memory_available("pinMemory=True")
+        self.generator = generator
 
         if method not in [None, 'shuffle', 'bootstrap']:
             raise Exception("method must be in [None, 'shuffle', 'bootstrap']")
@@ -170,6 +235,8 @@ class TorchTensorsDataLoader:
 
         if not batchSize: batchSize = len(self.dataset)
         self._set_batchSize_and_dropLast(batchSize, dropLast)
+
+        self._indices_buffer = None # allocated at the first shuffled/bootstrapped epoch
         
     def __len__ (self):
         """
@@ -180,29 +247,30 @@ class TorchTensorsDataLoader:
         
     def __iter__ (self):
         """
-        Return the iterator.
+        Return an iterator over the batches of an epoch.
         """
         
+        x_epoch, y_epoch = self._prepare_epoch()
+        batchSize = self.batchSize
+        for i in self._batch_starts:
+            yield x_epoch[i:i+batchSize], y_epoch[i:i+batchSize]
+
+    def _prepare_epoch (self):
+
+        # The epoch indices are drawn in place into a buffer reused across epochs. The samples of the epoch are
+        # gathered once: the batches are then contiguous slices (views)
         if self.method == 'bootstrap':
-            idx = np.random.randint(0, len(self.dataset), size=self.effectiveLength).tolist()
-            self._datasetToUseThisEpoch = self.dataset.subset(idx)
+            idx = th.randint(0, len(self.dataset), (self.effectiveLength,), generator=self.generator, 
+                             out=self._epoch_indices_buffer(self.effectiveLength))
         elif self.method == 'shuffle':
-            idx = np.random.permutation(len(self.dataset)).tolist()
-            self._datasetToUseThisEpoch = self.dataset.subset(idx)
+            idx = th.randperm(len(self.dataset), generator=self.generator, out=self._epoch_indices_buffer(len(self.dataset)))
         else:
-            self._datasetToUseThisEpoch = self.dataset
-        self._i = 0
-        return self
-
-    def __next__ (self):
-        """
-        Return the next batch.
-        """
-        
-        if self._i >= self.effectiveLength: raise StopIteration
-        batch = self._datasetToUseThisEpoch[self._i:self._i+self.batchSize]
-        self._i += self.batchSize
-        return batch
+            idx = None
+        if idx is not None: idx = idx.to(self.dataset.x.device)
+        x_epoch, y_epoch = self.dataset._select_xy(idx)
+        if self.pinMemory and x_epoch.device.type == "cpu" and not x_epoch.is_pinned():
+            x_epoch, y_epoch = x_epoch.pin_memory(), y_epoch.pin_memory()
+        return x_epoch, y_epoch
     
     def set_batchSize (self, batchSize):
         """
@@ -244,6 +312,19 @@ class TorchTensorsDataLoader:
         if not self.dropLast and remainder > 0: n_batches += 1  
         self.n_batches = n_batches
         self.effectiveLength = self.n_batches*self.batchSize
+        self._batch_starts = range(0, self.effectiveLength, self.batchSize)
+
+    def _epoch_indices_buffer (self, length):
+
+        # Long tensor of the given length on the device where the indices are drawn (the generator one, or
+        # else the dataset one), (re)allocated only when the current one is too short or on another device
+        # (e.g. after dataset.to(device))
+        device = self.dataset.x.device if self.generator is None else self.generator.device
+        buffer = self._indices_buffer
+        if buffer is None or buffer.shape[0] < length or buffer.device != device:
+            buffer = th.empty(max(length, len(self.dataset), self.effectiveLength), dtype=th.long, device=device)
+            self._indices_buffer = buffer
+        return buffer[:length]
 
     def __repr__ (self):
         
@@ -253,4 +334,50 @@ class TorchTensorsDataLoader:
     
     def __str__ (self):
     
-        return repr(self)
\ No newline at end of file
+        return repr(self)
+
+
+def pin_memory_available (what):
+    """
+    Check whether pinned memory can be used, i.e., whether CUDA is available. Pinned memory is allocated through 
+    the CUDA driver: without CUDA, pinning should be skipped with a warning (as the pin_memory option of 
+    torch.utils.data.DataLoader does) instead of raising.
+
+    Usage example:
+        if pin_memory_available("pin_memory()"):
+            <...>
+
+    Args:
+        what (str): The name of the calling method or option, used in the warning.
+
+    Returns:
+        available (bool). True if CUDA is available. If False, a warning is issued.
+    """
+
+    if th.cuda.is_available(): return True
+    warnings.warn(f"{what} is ignored since CUDA is not available: pinned memory won't be used", stacklevel=3)
+    return False
+
+
+def to_device (tensor, device, non_blocking):
+    """
+    Move a tensor to the given device. With non_blocking, from CPU to CUDA the copy goes through pinned memory 
+    (pinning only if not done yet), so that it is asynchronous even if the tensor is not pinned yet.
+
+    Usage example:
+        tensor = to_device(tensor, device, non_blocking)
+
+    Args:
+        tensor (torch.Tensor): The tensor to move.
+        device (torch.device): The device to move the tensor to.
+        non_blocking (bool): If True, the copy is asynchronous when possible, see torch.Tensor.to. If False, 
+            it is synchronous.
+
+    Returns:
+        tensor (torch.Tensor). The tensor on the given device.
+    """
+
+    if non_blocking and th.device(device).type == "cuda" and tensor.device.type == "cpu":
+        if not tensor.is_pinned(): tensor = tensor.pin_memory()
+        return tensor.to(device, non_blocking=True)
+    return tensor.to(device, non_blocking=non_blocking)